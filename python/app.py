@@ -1,36 +1,117 @@
 #!/usr/bin/env python3
 """
 Cursper - Voice to Text Backend
-Uses OpenAI Whisper for speech recognition
+Uses faster-whisper (CTranslate2) for speech recognition
 """
 
 import os
 import sys
-import json
+import shutil
+import uuid
 import tempfile
 import argparse
-from pathlib import Path
-from typing import Optional, Dict, Any
+import logging
+from collections import OrderedDict
+from typing import Optional, Dict, Any, List
 try:
     from flask import Flask, request, jsonify
     from flask_cors import CORS
-    import whisper
-    import torch
+    from werkzeug.exceptions import RequestEntityTooLarge
+    from faster_whisper import WhisperModel, decode_audio
+    from faster_whisper.audio import pad_or_trim
+    from faster_whisper.tokenizer import _LANGUAGE_CODES, Tokenizer
+    from faster_whisper.transcribe import TranscriptionOptions, get_suppressed_tokens
+    from faster_whisper.vad import VadOptions, get_speech_timestamps
+    import av
+    import ctranslate2
+    import numpy as np
+    import soundfile as sf
 except ImportError as e:
     print(f"Required dependency missing: {e}")
     print("Please install dependencies: pip install -r requirements.txt")
     sys.exit(1)
+import queue
 import threading
 import time
+import zlib
+from concurrent.futures import ThreadPoolExecutor
 
 app = Flask(__name__)
 CORS(app)
 
+# Reject oversized uploads before reading the body
+app.config['MAX_CONTENT_LENGTH'] = 256 * 1024 * 1024
+
+logger = logging.getLogger("cursper")
+
 # Global variables for model management
-current_model: Optional[Any] = None
+# Loaded models keyed by size, least recently used first
+loaded_models: "OrderedDict[str, Any]" = OrderedDict()
 current_model_size: str = "base"
 model_lock = threading.Lock()
 
+# How many model sizes to keep resident before evicting the least recently used
+MAX_LOADED_MODELS = 2
+
+# CTranslate2 compute type per --quant setting and device. "auto" keeps
+# float16 on GPU and int8 on CPU; CPUs have no fast float16 path
+QUANTIZATION_COMPUTE_TYPES = {
+    "auto": {"cuda": "float16", "cpu": "int8"},
+    "int8": {"cuda": "int8_float16", "cpu": "int8"},
+    "fp16": {"cuda": "float16", "cpu": "float32"},
+    "fp32": {"cuda": "float32", "cpu": "float32"}
+}
+model_quantization: str = "auto"
+
+# CTranslate2's FlashAttention kernels only run with fp16/bf16 activations
+FLASH_ATTENTION_COMPUTE_TYPES = {"float16", "int8_float16", "bfloat16", "int8_bfloat16"}
+
+# Single-consumer inference queue: Flask threads enqueue jobs and wait,
+# one worker thread owns the model while it runs
+inference_queue: "queue.Queue[TranscriptionJob]" = queue.Queue()
+inference_worker: Optional[threading.Thread] = None
+inference_worker_lock = threading.Lock()
+
+# Open /transcribe_stream sessions keyed by session id
+stream_sessions: Dict[str, "StreamSession"] = {}
+stream_sessions_lock = threading.Lock()
+
+# CPU stage of the pipeline: VAD trimming and log-mel extraction for queued
+# clips run here while the inference worker is busy with earlier jobs
+preprocess_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="cursper-preprocess")
+
+# Whisper models expect mono float32 audio at this sample rate
+SAMPLE_RATE = 16000
+
+# Clips up to one Whisper window long can share a batched encoder pass
+CHUNK_SAMPLES = 30 * SAMPLE_RATE
+
+# Silero VAD settings used to cut silence out of clips before they are encoded
+VAD_OPTIONS = VadOptions(min_silence_duration_ms=500)
+
+# Micro-batching: after the first job arrives, wait this long for others
+# to queue up, then run up to MAX_BATCH_SIZE of them together
+BATCH_WINDOW_SECONDS = 0.015
+MAX_BATCH_SIZE = 8
+
+# Streaming sessions keep at most STREAM_WINDOW_SECONDS of uncommitted audio.
+# Words are committed once they end STREAM_COMMIT_DELAY_SECONDS before the
+# window end, and sessions idle for STREAM_SESSION_TIMEOUT_SECONDS are dropped
+STREAM_WINDOW_SECONDS = 30
+STREAM_COMMIT_DELAY_SECONDS = 2.0
+STREAM_SESSION_TIMEOUT_SECONDS = 60
+
+# Sample rates accepted for /transcribe_stream chunks
+STREAM_MIN_SAMPLE_RATE = 8000
+STREAM_MAX_SAMPLE_RATE = 192000
+
+# Without memfd, request bodies are spooled in memory up to this size, then spill to disk
+SPOOL_MAX_MEMORY = 32 * 1024 * 1024
+
+# Language used when a request does not specify one (--language); None lets
+# the model detect it, which costs an extra decoder pass per clip
+default_language: Optional[str] = None
+
 # Available model sizes
 AVAILABLE_MODELS = {
     "tiny": "Fastest, lowest quality (39 MB)",
@@ -40,91 +121,453 @@ AVAILABLE_MODELS = {
     "large": "Best quality (1550 MB)"
 }
 
+def warm_up_model(model):
+    """Run one encoder/decoder pass on 30s of silence so the first request skips device init"""
+    logger.info("🔥 Warming up model...")
+    silence = np.zeros(30 * SAMPLE_RATE, dtype=np.float32)
+    segments, _ = model.transcribe(silence, language="en", beam_size=1, vad_filter=False)
+    for _ in segments:
+        pass
+
+def get_current_model():
+    """Return the model for current_model_size, or None if it is not loaded"""
+    return loaded_models.get(current_model_size)
+
 def load_model(model_size):
-    """Load or reload Whisper model"""
-    global current_model, current_model_size
-    
-    print(f"🔄 load_model called with size: {model_size}")
+    """Load a Whisper model, or switch to it if it is already cached"""
+    global current_model_size
     
     with model_lock:
-        print(f"🔒 Acquired model lock")
-        print(f"📊 Current model: {current_model}, Current size: {current_model_size}")
+        if model_size in loaded_models:
+            logger.debug("♻️  Model %s already loaded, switching", model_size)
+            loaded_models.move_to_end(model_size)
+            current_model_size = model_size
+            return True
         
-        if current_model is None or current_model_size != model_size:
-            print(f"🚀 Loading Whisper model: {model_size}")
+        # Evict least recently used sizes before loading, so that no more than
+        # MAX_LOADED_MODELS are ever resident, even while the new one loads
+        while len(loaded_models) >= MAX_LOADED_MODELS:
+            evicted_size, evicted_model = loaded_models.popitem(last=False)
+            del evicted_model
+            logger.info("🗑️  Evicted model %s", evicted_size)
+        
+        logger.info("🚀 Loading Whisper model: %s", model_size)
+        try:
+            if ctranslate2.get_cuda_device_count() > 0:
+                compute_type = QUANTIZATION_COMPUTE_TYPES[model_quantization]["cuda"]
+                # FlashAttention kernels need compute capability 8.0+ (Ampere), which is
+                # also when CTranslate2 starts reporting bfloat16 support
+                flash_attention = (
+                    compute_type in FLASH_ATTENTION_COMPUTE_TYPES
+                    and "bfloat16" in ctranslate2.get_supported_compute_types("cuda")
+                )
+                logger.info("⏳ Loading '%s' on CUDA (%s, flash attention: %s)...",
+                            model_size, compute_type, flash_attention)
+                model = WhisperModel(model_size, device="cuda", compute_type=compute_type,
+                                     flash_attention=flash_attention)
+            else:
+                compute_type = QUANTIZATION_COMPUTE_TYPES[model_quantization]["cpu"]
+                logger.info("⏳ Loading '%s' on CPU (%s)...", model_size, compute_type)
+                model = WhisperModel(model_size, device="cpu", compute_type=compute_type,
+                                     cpu_threads=os.cpu_count() or 0)
+            warm_up_model(model)
+        except Exception:
+            logger.exception("❌ Error loading model %s", model_size)
+            return False
+        
+        loaded_models[model_size] = model
+        current_model_size = model_size
+        logger.info("✅ Model %s loaded successfully", model_size)
+        return True
+
+def spool_request_body(stream):
+    """Copy a request body stream into a seekable spooled file in 1 MiB chunks"""
+    spool = None
+    if hasattr(os, "memfd_create"):
+        # Linux: an anonymous tmpfs-backed file never touches the filesystem
+        # and disappears with its last descriptor, so there is nothing to unlink
+        try:
+            spool = open(os.memfd_create("cursper-audio", os.MFD_CLOEXEC), "w+b")
+        except OSError:
+            # Old kernels and seccomp-restricted containers reject the syscall
+            logger.debug("⚠️  memfd_create unavailable, spooling to a temporary file")
+    if spool is None:
+        spool = tempfile.SpooledTemporaryFile(max_size=SPOOL_MAX_MEMORY)
+    shutil.copyfileobj(stream, spool, length=1 << 20)
+    spool.seek(0)
+    return spool
+
+def resample_audio(audio, sample_rate):
+    """Resample mono float32 audio to SAMPLE_RATE with libswresample"""
+    frame = av.AudioFrame.from_ndarray(audio.reshape(1, -1), format="flt", layout="mono")
+    frame.sample_rate = sample_rate
+    resampler = av.AudioResampler(format="flt", layout="mono", rate=SAMPLE_RATE)
+    # Passing None flushes the samples still buffered in the resampler
+    frames = resampler.resample(frame) + resampler.resample(None)
+    if not frames:
+        # Inputs shorter than the resampler's filter delay produce no output
+        return np.zeros(0, dtype=np.float32)
+    return np.concatenate([frame.to_ndarray().reshape(-1) for frame in frames])
+
+def decode_audio_file(audio_file):
+    """Decode a seekable audio file object into a mono float32 array at SAMPLE_RATE"""
+    try:
+        audio, sample_rate = sf.read(audio_file, dtype="float32", always_2d=True)
+    except sf.LibsndfileError:
+        # Formats libsndfile cannot read (mp3, webm, ...) go through PyAV
+        audio_file.seek(0)
+        return decode_audio(audio_file, sampling_rate=SAMPLE_RATE)
+    
+    audio = audio.mean(axis=1) if audio.shape[1] > 1 else audio[:, 0]
+    if sample_rate != SAMPLE_RATE:
+        audio = resample_audio(audio, sample_rate)
+    return np.ascontiguousarray(audio, dtype=np.float32)
+
+def transcription_options(tokenizer):
+    """Decoding options of model.transcribe(beam_size=1) with its other defaults"""
+    return TranscriptionOptions(
+        beam_size=1,
+        best_of=5,
+        patience=1,
+        length_penalty=1,
+        repetition_penalty=1,
+        no_repeat_ngram_size=0,
+        log_prob_threshold=-1.0,
+        no_speech_threshold=0.6,
+        compression_ratio_threshold=2.4,
+        condition_on_previous_text=True,
+        prompt_reset_on_temperature=0.5,
+        temperatures=[0.0, 0.2, 0.4, 0.6, 0.8, 1.0],
+        initial_prompt=None,
+        prefix=None,
+        suppress_blank=True,
+        suppress_tokens=get_suppressed_tokens(tokenizer, [-1]),
+        without_timestamps=False,
+        max_initial_timestamp=1.0,
+        word_timestamps=False,
+        prepend_punctuations="\"'“¿([{-",
+        append_punctuations="\"'.。,，!！?？:：”)]}、",
+        multilingual=False,
+        max_new_tokens=None,
+        clip_timestamps="0",
+        hallucination_silence_threshold=None,
+        hotwords=None
+    )
+
+def run_transcription(model, features, language):
+    """Decode a clip's precomputed log-mel with faster-whisper and collect the streamed segments"""
+    # This is model.transcribe minus VAD and feature extraction, which already
+    # ran on the preprocessing executor
+    if not model.model.is_multilingual:
+        language = "en"
+    elif language is None:
+        language, _, _ = model.detect_language(features=features)
+    tokenizer = Tokenizer(model.hf_tokenizer, model.model.is_multilingual,
+                          task="transcribe", language=language)
+    segments = model.generate_segments(features, tokenizer, transcription_options(tokenizer), False)
+    text = "".join(segment.text for segment in segments)
+    return {"text": text, "language": language}
+
+def silent_result(language):
+    """Result for a clip in which VAD found no speech"""
+    return {"text": "", "language": language or "unknown"}
+
+def collect_speech(audio):
+    """Keep only the voiced parts of the audio, as detected by Silero VAD"""
+    speech_chunks = get_speech_timestamps(audio, VAD_OPTIONS)
+    if not speech_chunks:
+        return audio[:0]
+    return np.concatenate([audio[chunk["start"]:chunk["end"]] for chunk in speech_chunks])
+
+def prepare_clip(audio, feature_extractor):
+    """CPU stage: trim silence and precompute the log-mel of the remaining speech"""
+    speech = collect_speech(audio)
+    features = None
+    if len(speech) and feature_extractor is not None:
+        features = feature_extractor(speech)
+    return {"speech": speech, "features": features, "feature_extractor": feature_extractor}
+
+def clip_features(model, clip):
+    """Log-mel of a prepared clip, recomputed if it was built for a different model"""
+    if clip["feature_extractor"] is model.feature_extractor:
+        return clip["features"]
+    # e.g. after /set_model, or when no model was loaded at submit time
+    return model.feature_extractor(clip["speech"])
+
+def run_batched_transcription(model, clips, languages):
+    """Transcribe prepared clips of at most 30s with a single batched encoder and decoder pass"""
+    results: List[Dict[str, Any]] = [silent_result(language) for language in languages]
+    voiced = [i for i, clip in enumerate(clips) if len(clip["speech"])]
+    if not voiced:
+        return results
+    
+    features = {i: clip_features(model, clips[i]) for i in voiced}
+    # Pad every log-mel to the full 30s window and encode them together
+    encoder_output = model.encode(np.stack([
+        pad_or_trim(features[i], model.feature_extractor.nb_max_frames) for i in voiced
+    ]))
+    
+    languages = [languages[i] for i in voiced]
+    if not model.model.is_multilingual:
+        languages = ["en"] * len(voiced)
+    elif None in languages:
+        # Only detect when some clip did not specify its language
+        detected = [
+            probabilities[0][0][2:-2]
+            for probabilities in model.model.detect_language(encoder_output)
+        ]
+        languages = [language or detected[i] for i, language in enumerate(languages)]
+    
+    prompts = []
+    job_tokenizers = []
+    for language in languages:
+        tokenizer = Tokenizer(model.hf_tokenizer, model.model.is_multilingual,
+                              task="transcribe", language=language)
+        job_tokenizers.append(tokenizer)
+        prompts.append(tokenizer.sot_sequence + [tokenizer.no_timestamps])
+    
+    outputs = model.model.generate(
+        encoder_output,
+        prompts,
+        beam_size=1,
+        max_length=model.max_length,
+        suppress_blank=True,
+        suppress_tokens=[-1],
+        return_scores=True,
+        return_no_speech_prob=True
+    )
+    
+    for i, language, tokenizer, output in zip(voiced, languages, job_tokenizers, outputs):
+        tokens = output.sequences_ids[0]
+        avg_logprob = output.scores[0] * len(tokens) / (len(tokens) + 1)
+        # Same silence rule as faster-whisper's no_speech_threshold/log_prob_threshold
+        if output.no_speech_prob > 0.6 and avg_logprob < -1.0:
+            results[i] = {"text": "", "language": language}
+            continue
+        text = tokenizer.decode(tokens)
+        text_bytes = text.encode("utf-8")
+        compression_ratio = len(text_bytes) / len(zlib.compress(text_bytes)) if text_bytes else 0.0
+        if compression_ratio > 2.4 or avg_logprob < -1.0:
+            # The greedy pass looks repetitive or unsure: redo this clip through
+            # model.transcribe so it gets the same temperature fallback as a lone job
+            results[i] = run_transcription(model, features[i], language)
+        else:
+            results[i] = {"text": text, "language": language}
+    return results
+
+def run_word_transcription(model, audio, language):
+    """Transcribe a streaming window, returning words timed relative to its start"""
+    segments, info = model.transcribe(
+        audio,
+        language=language,
+        beam_size=1,
+        vad_filter=True,
+        vad_parameters=VAD_OPTIONS,
+        word_timestamps=True
+    )
+    words = [
+        {"word": word.word, "start": word.start, "end": word.end}
+        for segment in segments
+        for word in segment.words or []
+    ]
+    return {"words": words, "language": info.language}
+
+def process_jobs(model, jobs):
+    """Transcribe a drained group of jobs, batching the clips whose speech fits one window"""
+    clips = {}
+    for job in jobs:
+        if job.word_timestamps:
+            # Streaming windows keep their timeline, so they skip VAD trimming and batching
             try:
-                print(f"⏳ Calling whisper.load_model('{model_size}')...")
-                current_model = whisper.load_model(model_size)
-                current_model_size = model_size
-                print(f"✅ Model {model_size} loaded successfully")
-                print(f"📋 Model type: {type(current_model)}")
-                return True
+                job.result = run_word_transcription(model, job.audio, job.language)
             except Exception as e:
-                error_msg = f"Error loading model {model_size}: {e}"
-                print(f"❌ {error_msg}")
-                return False
-        else:
-            print(f"♻️  Model {model_size} already loaded, skipping")
-            return True
+                job.error = e
+            continue
+        try:
+            clips[job] = job.prepared.result()
+        except Exception as e:
+            job.error = e
+    
+    short_jobs = [job for job in clips if len(clips[job]["speech"]) <= CHUNK_SAMPLES]
+    if len(short_jobs) > 1:
+        try:
+            results = run_batched_transcription(model, [clips[job] for job in short_jobs],
+                                                [job.language for job in short_jobs])
+            for job, result in zip(short_jobs, results):
+                job.result = result
+        except Exception as e:
+            for job in short_jobs:
+                job.error = e
+        remaining = [job for job in clips if job not in short_jobs]
+    else:
+        remaining = list(clips)
+    
+    for job in remaining:
+        try:
+            if len(clips[job]["speech"]):
+                job.result = run_transcription(model, clip_features(model, clips[job]), job.language)
+            else:
+                job.result = silent_result(job.language)
+        except Exception as e:
+            job.error = e
+
+class TranscriptionJob:
+    """A queued transcription request, completed by the inference worker"""
+
+    def __init__(self, audio, prepared, language=None, word_timestamps=False):
+        self.audio = audio
+        self.language = language
+        # Future of prepare_clip(), computed on the preprocessing executor
+        self.prepared = prepared
+        self.word_timestamps = word_timestamps
+        self.event = threading.Event()
+        self.result: Optional[Dict[str, Any]] = None
+        self.error: Optional[BaseException] = None
+
+def inference_worker_loop():
+    """Drain the inference queue, coalescing jobs that arrive within the batch window"""
+    while True:
+        jobs = [inference_queue.get()]
+        time.sleep(BATCH_WINDOW_SECONDS)
+        while len(jobs) < MAX_BATCH_SIZE:
+            try:
+                jobs.append(inference_queue.get_nowait())
+            except queue.Empty:
+                break
+        
+        try:
+            with model_lock:
+                model = get_current_model()
+                if model is None:
+                    raise Exception("Model became None during transcription")
+                process_jobs(model, jobs)
+        except Exception as e:
+            for job in jobs:
+                if job.result is None:
+                    job.error = e
+        finally:
+            for job in jobs:
+                job.event.set()
+                inference_queue.task_done()
+
+def start_inference_worker():
+    """Start the inference worker thread if it is not already running"""
+    global inference_worker
+
+    with inference_worker_lock:
+        if inference_worker is None or not inference_worker.is_alive():
+            inference_worker = threading.Thread(
+                target=inference_worker_loop,
+                name="cursper-inference",
+                daemon=True
+            )
+            inference_worker.start()
+
+def submit_transcription(audio, language=None, word_timestamps=False):
+    """Queue audio for the inference worker and block until it is transcribed"""
+    start_inference_worker()
+    prepared = None
+    if not word_timestamps:
+        model = get_current_model()
+        feature_extractor = model.feature_extractor if model is not None else None
+        prepared = preprocess_executor.submit(prepare_clip, audio, feature_extractor)
+    job = TranscriptionJob(audio, prepared, language or default_language, word_timestamps)
+    inference_queue.put(job)
+    job.event.wait()
+    if job.error is not None:
+        raise job.error
+    return job.result
+
+class StreamSession:
+    """Bounded audio window of a /transcribe_stream session"""
+
+    def __init__(self):
+        self.audio = np.zeros(0, dtype=np.float32)
+        # Stream time in seconds of the first sample in the window
+        self.offset = 0.0
+        self.last_seen = time.monotonic()
+        self.lock = threading.Lock()
+
+    def trim(self, seconds):
+        """Drop audio from the start of the window"""
+        samples = min(max(int(seconds * SAMPLE_RATE), 0), len(self.audio))
+        self.audio = self.audio[samples:]
+        self.offset += samples / SAMPLE_RATE
+
+def get_stream_session(session_id):
+    """Look up or create a streaming session, expiring idle ones"""
+    now = time.monotonic()
+    with stream_sessions_lock:
+        for expired_id in [sid for sid, session in stream_sessions.items()
+                           if now - session.last_seen > STREAM_SESSION_TIMEOUT_SECONDS]:
+            del stream_sessions[expired_id]
+        
+        if session_id is None:
+            session_id = uuid.uuid4().hex
+        session = stream_sessions.get(session_id)
+        if session is None:
+            session = stream_sessions[session_id] = StreamSession()
+        session.last_seen = now
+        return session_id, session
+
+def validate_language(language):
+    """Return an error message if the current model cannot transcribe this language"""
+    model = get_current_model()
+    # Without a loaded model (e.g. the initial load failed), check against
+    # every language Whisper knows so a typo is still rejected
+    supported_languages = model.supported_languages if model is not None else list(_LANGUAGE_CODES)
+    if language is None or language in supported_languages:
+        return None
+    return f"Unsupported language '{language}'. Available: {supported_languages}"
 
 @app.route('/health', methods=['GET'])
 def health_check():
     """Health check endpoint"""
-    print("=" * 50)
-    print("🔍 HEALTH CHECK REQUEST RECEIVED")
-    print(f"🕐 Time: {time.strftime('%Y-%m-%d %H:%M:%S')}")
-    print(f"🌐 Request from: {request.remote_addr}")
-    print(f"📋 Request headers: {dict(request.headers)}")
-    print(f"🧠 Current model: {current_model_size}")
-    print(f"🔍 Model loaded: {current_model is not None}")
+    if logger.isEnabledFor(logging.DEBUG):
+        logger.debug("🔍 Health check from %s (model %s, loaded: %s)",
+                     request.remote_addr, current_model_size, get_current_model() is not None)
     
     response = {
         "status": "healthy",
         "current_model": current_model_size,
-        "model_loaded": current_model is not None,
+        "model_loaded": get_current_model() is not None,
         "available_models": AVAILABLE_MODELS,
         "timestamp": time.strftime('%Y-%m-%d %H:%M:%S')
     }
-    print(f"✅ Health check response: {response}")
-    print("=" * 50)
     return jsonify(response)
 
 @app.route('/models', methods=['GET'])
 def get_models():
     """Get available models"""
-    print("📋 Available models requested")
+    logger.debug("📋 Available models requested")
     response = {
         "available_models": AVAILABLE_MODELS,
         "current_model": current_model_size
     }
-    print(f"✅ Models response: {response}")
     return jsonify(response)
 
 @app.route('/set_model', methods=['POST'])
 def set_model():
     """Set the active model"""
-    print("🔧 Set model request received")
     data = request.get_json()
     model_size = data.get('model_size', 'base')
-    print(f"📝 Requested model size: {model_size}")
+    logger.info("🔧 Set model request: %s", model_size)
     
     if model_size not in AVAILABLE_MODELS:
         error_msg = f"Invalid model size. Available: {list(AVAILABLE_MODELS.keys())}"
-        print(f"❌ {error_msg}")
+        logger.warning("❌ %s", error_msg)
         return jsonify({"error": error_msg}), 400
     
-    print(f"🔄 Loading model: {model_size}")
     success = load_model(model_size)
     if success:
         response = {
             "message": f"Model set to {model_size}",
             "current_model": current_model_size
         }
-        print(f"✅ Model set successfully: {response}")
         return jsonify(response)
     else:
         error_msg = f"Failed to load model {model_size}"
-        print(f"❌ {error_msg}")
+        logger.error("❌ %s", error_msg)
         return jsonify({"error": error_msg}), 500
 
 @app.route('/transcribe', methods=['POST'])
@@ -132,12 +575,12 @@ def transcribe_audio():
     """Transcribe audio file to text"""
     try:
         # Check if model is loaded
-        if current_model is None:
+        if get_current_model() is None:
             if not load_model(current_model_size):
                 return jsonify({"error": "Failed to load Whisper model"}), 500
         
         # Double-check model is not None after loading
-        if current_model is None:
+        if get_current_model() is None:
             return jsonify({"error": "Whisper model not available"}), 500
         
         # Check if file is in request
@@ -148,240 +591,309 @@ def transcribe_audio():
         if audio_file.filename == '':
             return jsonify({"error": "No audio file selected"}), 400
         
-        # Save uploaded file temporarily
-        with tempfile.NamedTemporaryFile(delete=False, suffix='.wav') as temp_file:
-            audio_file.save(temp_file.name)
-            temp_path = temp_file.name
+        language = request.form.get('language') or None
+        language_error = validate_language(language)
+        if language_error:
+            return jsonify({"error": language_error}), 400
         
+        # Decode the upload straight from its spooled stream and transcribe with Whisper
         try:
-            # Transcribe with Whisper
-            with model_lock:
-                if current_model is not None:
-                    result = current_model.transcribe(temp_path)
-                else:
-                    raise Exception("Model became None during transcription")
-            
-            # Clean up temp file
-            os.unlink(temp_path)
-            
-            return jsonify({
-                "text": result["text"].strip(),
-                "language": result.get("language", "unknown"),
-                "model_used": current_model_size
-            })
-            
+            audio = decode_audio_file(audio_file.stream)
         except Exception as e:
-            # Clean up temp file on error
-            if os.path.exists(temp_path):
-                os.unlink(temp_path)
-            raise e
-            
+            error_msg = f"Failed to decode audio data: {str(e)}"
+            logger.exception("❌ %s", error_msg)
+            return jsonify({"error": error_msg}), 400
+        result = submit_transcription(audio, language)
+        
+        return jsonify({
+            "text": result["text"].strip(),
+            "language": result.get("language", "unknown"),
+            "model_used": current_model_size
+        })
+    
+    except RequestEntityTooLarge:
+        error_msg = f"Audio upload exceeds {app.config['MAX_CONTENT_LENGTH']} bytes"
+        logger.warning("❌ %s", error_msg)
+        return jsonify({"error": error_msg}), 413
     except Exception as e:
+        logger.exception("❌ Transcription failed")
         return jsonify({"error": str(e)}), 500
 
 @app.route('/transcribe_raw', methods=['POST'])
 def transcribe_raw_audio():
     """Transcribe raw audio bytes"""
-    print("=" * 60)
-    print("🎤 RAW AUDIO TRANSCRIPTION REQUEST RECEIVED")
-    print(f"🕐 Time: {time.strftime('%Y-%m-%d %H:%M:%S')}")
-    print(f"🌐 Request from: {request.remote_addr}")
-    print(f"📋 Request headers: {dict(request.headers)}")
-    print(f"📋 Request method: {request.method}")
-    print(f"📋 Request content type: {request.content_type}")
-    print(f"📋 Request content length: {request.content_length}")
-    print("=" * 60)
+    if logger.isEnabledFor(logging.DEBUG):
+        logger.debug("🎤 Raw transcription request from %s (type %s, length %s), headers: %s",
+                     request.remote_addr, request.content_type, request.content_length, request.headers)
     
     try:
         # Check if model is loaded
-        print(f"🔍 Checking if model is loaded. Current model: {current_model}")
-        print(f"🔍 Current model size: {current_model_size}")
-        
-        if current_model is None:
-            print("⚠️  Model not loaded, attempting to load...")
+        if get_current_model() is None:
+            logger.warning("⚠️  Model not loaded, attempting to load...")
             if not load_model(current_model_size):
                 error_msg = "Failed to load Whisper model"
-                print(f"❌ {error_msg}")
+                logger.error("❌ %s", error_msg)
                 return jsonify({"error": error_msg}), 500
         
         # Double-check model is not None after loading
-        if current_model is None:
+        if get_current_model() is None:
             error_msg = "Whisper model not available after loading attempt"
-            print(f"❌ {error_msg}")
+            logger.error("❌ %s", error_msg)
             return jsonify({"error": error_msg}), 500
         
-        print("✅ Whisper model is available")
-        print(f"📊 Model type: {type(current_model)}")
+        # The body is the audio itself, so the language comes from the query string
+        language = request.args.get('language') or None
+        language_error = validate_language(language)
+        if language_error:
+            logger.warning("❌ %s", language_error)
+            return jsonify({"error": language_error}), 400
         
-        # Get raw audio data
+        # Stream the raw audio body into a spooled file
         try:
-            audio_data = request.get_data()
-            print(f"📊 Received audio data: {len(audio_data)} bytes")
+            audio_stream = spool_request_body(request.stream)
+        except RequestEntityTooLarge:
+            error_msg = f"Audio data exceeds {app.config['MAX_CONTENT_LENGTH']} bytes"
+            logger.warning("❌ %s", error_msg)
+            return jsonify({"error": error_msg}), 413
         except Exception as e:
             error_msg = f"Failed to get audio data from request: {str(e)}"
-            print(f"❌ {error_msg}")
-            import traceback
-            print(f"🔍 Stack trace: {traceback.format_exc()}")
-            return jsonify({"error": error_msg}), 400
-        
-        if not audio_data:
-            error_msg = "No audio data provided in request body"
-            print(f"❌ {error_msg}")
+            logger.exception("❌ %s", error_msg)
             return jsonify({"error": error_msg}), 400
         
-        # Analyze the first few bytes to see what we got
-        if len(audio_data) >= 12:
-            header = audio_data[:12]
-            print(f"📋 Audio data header (first 12 bytes): {header}")
-            print(f"📋 Header as hex: {header.hex()}")
-            print(f"📋 Header as string (ignore errors): {header.decode('ascii', errors='ignore')}")
-        
-        # Check for dummy/invalid audio data (all zeros or very small)
-        if len(audio_data) < 1000:
-            print(f"⚠️  Audio data too small: {len(audio_data)} bytes")
-            if all(b == 0 for b in audio_data[:min(100, len(audio_data))]):
-                print("⚠️  Audio data appears to be all zeros, returning test message")
-                response = {
-                    "text": "🧪 Test transcription - received zero audio data",
-                    "language": "en", 
-                    "model_used": current_model_size
-                }
-                print(f"🎉 Returning test response: {response}")
-                return jsonify(response)
-        
-        # Save raw data to temporary file
-        print("💾 Saving audio data to temporary file...")
-        try:
-            with tempfile.NamedTemporaryFile(delete=False, suffix='.wav') as temp_file:
-                temp_file.write(audio_data)
-                temp_path = temp_file.name
-                print(f"📁 Temporary file created: {temp_path}")
-                
-            # Verify the file was written correctly
-            import os
-            file_size = os.path.getsize(temp_path)
-            print(f"📊 Temporary file size: {file_size} bytes")
-            
-            if file_size != len(audio_data):
-                print(f"⚠️  File size mismatch! Expected {len(audio_data)}, got {file_size}")
-            
-        except Exception as e:
-            error_msg = f"Failed to save audio data to temporary file: {str(e)}"
-            print(f"❌ {error_msg}")
-            import traceback
-            print(f"🔍 Stack trace: {traceback.format_exc()}")
-            return jsonify({"error": error_msg}), 500
-        
-        try:
-            # Transcribe with Whisper
-            print("🧠 Starting Whisper transcription...")
-            print(f"🔍 Using model: {current_model_size}")
-            print(f"🔍 Model object: {current_model}")
-            print(f"🔍 Temp file path: {temp_path}")
+        with audio_stream:
+            audio_size = audio_stream.seek(0, os.SEEK_END)
+            audio_stream.seek(0)
             
-            with model_lock:
-                print("🔒 Acquired model lock")
-                if current_model is not None:
-                    print(f"🔄 Calling current_model.transcribe('{temp_path}')")
-                    
-                    # Call Whisper transcription with more detailed error handling
-                    try:
-                        result = current_model.transcribe(temp_path)
-                        print(f"✅ Whisper transcription raw result: {result}")
-                        print(f"📝 Result type: {type(result)}")
-                        if isinstance(result, dict):
-                            print(f"📝 Result keys: {list(result.keys())}")
-                    except Exception as whisper_error:
-                        error_msg = f"Whisper transcription failed: {str(whisper_error)}"
-                        print(f"❌ {error_msg}")
-                        import traceback
-                        print(f"🔍 Whisper error stack trace: {traceback.format_exc()}")
-                        raise whisper_error
-                        
-                else:
-                    error_msg = "Model became None during transcription"
-                    print(f"❌ {error_msg}")
-                    raise Exception(error_msg)
+            if not audio_size:
+                error_msg = "No audio data provided in request body"
+                logger.warning("❌ %s", error_msg)
+                return jsonify({"error": error_msg}), 400
             
-            print("🔓 Released model lock")
+            logger.debug("📊 Received audio data: %d bytes", audio_size)
             
-            # Clean up temp file
-            print(f"🗑️  Cleaning up temporary file: {temp_path}")
-            try:
-                os.unlink(temp_path)
-                print("✅ Temporary file cleaned up")
-            except Exception as cleanup_error:
-                print(f"⚠️  Failed to clean up temp file: {cleanup_error}")
+            # Check for dummy/invalid audio data (all zeros or very small)
+            if audio_size < 1000:
+                logger.warning("⚠️  Audio data too small: %d bytes", audio_size)
+                head = audio_stream.read(100)
+                audio_stream.seek(0)
+                if not np.frombuffer(head, dtype=np.uint8).any():
+                    logger.warning("⚠️  Audio data appears to be all zeros, returning test message")
+                    response = {
+                        "text": "🧪 Test transcription - received zero audio data",
+                        "language": "en", 
+                        "model_used": current_model_size
+                    }
+                    return jsonify(response)
             
-            # Process the result
+            # Decode raw data from the spool
             try:
-                response = {
-                    "text": result["text"].strip() if "text" in result else "No text found",
-                    "language": result.get("language", "unknown"),
-                    "model_used": current_model_size
-                }
-                print(f"🎉 Transcription successful: {response}")
-                return jsonify(response)
-            except Exception as response_error:
-                error_msg = f"Failed to process transcription result: {str(response_error)}"
-                print(f"❌ {error_msg}")
-                print(f"🔍 Raw result was: {result}")
-                import traceback
-                print(f"🔍 Response processing stack trace: {traceback.format_exc()}")
-                return jsonify({"error": error_msg}), 500
-            
-        except Exception as transcription_error:
-            # Clean up temp file on error
-            if os.path.exists(temp_path):
-                print(f"🗑️  Cleaning up temporary file after error: {temp_path}")
-                try:
-                    os.unlink(temp_path)
-                except:
-                    pass
-            
-            error_msg = f"Transcription process error: {str(transcription_error)}"
-            print(f"❌ {error_msg}")
-            import traceback
-            print(f"🔍 Transcription error stack trace: {traceback.format_exc()}")
-            raise transcription_error
+                audio = decode_audio_file(audio_stream)
+            except Exception as e:
+                error_msg = f"Failed to decode audio data: {str(e)}"
+                logger.exception("❌ %s", error_msg)
+                return jsonify({"error": error_msg}), 400
+        
+        logger.debug("📊 Decoded %d samples", len(audio))
+        
+        # Transcribe with Whisper
+        result = submit_transcription(audio, language)
+        
+        response = {
+            "text": result["text"].strip() if "text" in result else "No text found",
+            "language": result.get("language", "unknown"),
+            "model_used": current_model_size
+        }
+        logger.debug("🎉 Transcription successful: %s", response)
+        return jsonify(response)
             
     except Exception as e:
         error_msg = f"Raw transcription endpoint failed: {str(e)}"
-        print(f"❌ {error_msg}")
-        print(f"❌ Error type: {type(e).__name__}")
-        import traceback
-        print(f"🔍 Full stack trace:")
-        print(traceback.format_exc())
+        logger.exception("❌ %s", error_msg)
+        # The traceback goes to the log only; it is not exposed to clients
         return jsonify({
             "error": error_msg,
-            "error_type": type(e).__name__,
-            "traceback": traceback.format_exc()
+            "error_type": type(e).__name__
         }), 500
 
+@app.route('/transcribe_stream', methods=['POST'])
+def transcribe_stream():
+    """Transcribe live audio sent as a sequence of 16-bit PCM mono chunks.
+    
+    Query parameters: session (omit on the first chunk), sample_rate
+    (defaults to 16000), language and final=1 on the last chunk to flush
+    the window.
+    """
+    session_id = request.args.get('session')
+    language = request.args.get('language') or None
+    final = request.args.get('final', '').lower() in ('1', 'true')
+    try:
+        sample_rate = int(request.args.get('sample_rate', SAMPLE_RATE))
+    except ValueError:
+        return jsonify({"error": "sample_rate must be an integer"}), 400
+    if not STREAM_MIN_SAMPLE_RATE <= sample_rate <= STREAM_MAX_SAMPLE_RATE:
+        return jsonify({"error": f"sample_rate must be between {STREAM_MIN_SAMPLE_RATE} "
+                                 f"and {STREAM_MAX_SAMPLE_RATE}"}), 400
+    # A single chunk may fill at most one window, which bounds the audio
+    # submitted per request to the carried-over window plus this chunk
+    max_chunk_bytes = STREAM_WINDOW_SECONDS * sample_rate * 2
+    chunk_too_large = f"Audio chunk exceeds {STREAM_WINDOW_SECONDS}s"
+    
+    try:
+        if get_current_model() is None:
+            if not load_model(current_model_size):
+                return jsonify({"error": "Failed to load Whisper model"}), 500
+        
+        language_error = validate_language(language)
+        if language_error:
+            return jsonify({"error": language_error}), 400
+        
+        # Reject oversized chunks before buffering them, rather than reading
+        # up to MAX_CONTENT_LENGTH; bodies without a Content-Length are read
+        # only one byte past the limit
+        if (request.content_length or 0) > max_chunk_bytes:
+            logger.warning("❌ %s", chunk_too_large)
+            return jsonify({"error": chunk_too_large}), 413
+        pcm = bytearray()
+        while len(pcm) <= max_chunk_bytes:
+            block = request.stream.read(min(1 << 20, max_chunk_bytes + 1 - len(pcm)))
+            if not block:
+                break
+            pcm += block
+        if len(pcm) > max_chunk_bytes:
+            logger.warning("❌ %s", chunk_too_large)
+            return jsonify({"error": chunk_too_large}), 413
+        if len(pcm) % 2:
+            return jsonify({"error": "Audio chunk must be 16-bit PCM"}), 400
+        chunk = np.frombuffer(pcm, dtype="<i2").astype(np.float32) / 32768.0
+        if len(chunk) and sample_rate != SAMPLE_RATE:
+            chunk = resample_audio(chunk, sample_rate)
+        
+        session_id, session = get_stream_session(session_id)
+        with session.lock:
+            session.audio = np.concatenate([session.audio, chunk])
+            
+            committed = []
+            detected_language = language or default_language or "unknown"
+            pending = []
+            if len(session.audio):
+                result = submit_transcription(session.audio, language, word_timestamps=True)
+                detected_language = result["language"]
+                window_offset = session.offset
+                window_end = len(session.audio) / SAMPLE_RATE
+                commit_before = window_end if final else window_end - STREAM_COMMIT_DELAY_SECONDS
+                # Keep the window bounded even if nothing could be committed:
+                # words starting before the cut are committed rather than dropped
+                overflow = window_end - STREAM_WINDOW_SECONDS
+                committed = []
+                for word in result["words"]:
+                    if word["end"] > commit_before and word["start"] >= overflow:
+                        break
+                    committed.append(word)
+                pending = result["words"][len(committed):]
+                
+                # Trim the window up to the last committed word, or drop speech-free
+                # audio that can no longer hold the start of a word
+                if committed:
+                    trim_to = committed[-1]["end"]
+                elif not pending:
+                    trim_to = commit_before
+                else:
+                    trim_to = 0.0
+                session.trim(max(trim_to, overflow))
+                
+                # Report committed words on the stream's timeline
+                committed = [
+                    {"word": word["word"],
+                     "start": round(word["start"] + window_offset, 3),
+                     "end": round(word["end"] + window_offset, 3)}
+                    for word in committed
+                ]
+        
+        if final:
+            with stream_sessions_lock:
+                stream_sessions.pop(session_id, None)
+        
+        return jsonify({
+            "session": session_id,
+            "committed": committed,
+            "text": "".join(word["word"] for word in committed),
+            "pending": "".join(word["word"] for word in pending),
+            "language": detected_language,
+            "final": final,
+            "model_used": current_model_size
+        })
+    
+    except RequestEntityTooLarge:
+        error_msg = f"Audio chunk exceeds {app.config['MAX_CONTENT_LENGTH']} bytes"
+        logger.warning("❌ %s", error_msg)
+        return jsonify({"error": error_msg}), 413
+    except Exception as e:
+        error_msg = f"Streaming transcription failed: {str(e)}"
+        logger.exception("❌ %s", error_msg)
+        return jsonify({"error": error_msg}), 500
+
+def initialize_backend(model_size, quantization="auto", language=None):
+    """Load the initial model and warm the inference pipeline before serving"""
+    global model_quantization, default_language, current_model_size
+    
+    # Requests that arrive while this is still loading then wait on model_lock
+    # for the same size instead of loading the default one alongside it
+    current_model_size = model_size
+    if quantization in QUANTIZATION_COMPUTE_TYPES:
+        model_quantization = quantization
+    else:
+        logger.error("❌ Invalid quantization '%s' (available: %s), falling back to auto",
+                     quantization, list(QUANTIZATION_COMPUTE_TYPES.keys()))
+        model_quantization = "auto"
+    loaded = load_model(model_size)
+    
+    language_error = validate_language(language)
+    if language_error:
+        logger.error("❌ %s, falling back to language detection", language_error)
+    else:
+        default_language = language
+    
+    if not loaded:
+        return False
+    # Run one request through the worker so the VAD model and inference
+    # thread are initialised before the first real transcription
+    submit_transcription(np.zeros(SAMPLE_RATE, dtype=np.float32))
+    return True
+
 def main():
     parser = argparse.ArgumentParser(description='Cursper Voice to Text Backend')
     parser.add_argument('--port', type=int, default=8788, help='Port to run the server on')
     parser.add_argument('--host', default='127.0.0.1', help='Host to bind to')
     parser.add_argument('--model', default='base', choices=list(AVAILABLE_MODELS.keys()),
                        help='Initial Whisper model to load')
+    parser.add_argument('--quant', default='auto', choices=list(QUANTIZATION_COMPUTE_TYPES.keys()),
+                       help='Weight quantization (auto: fp16 on GPU, int8 on CPU)')
+    parser.add_argument('--language', default=None,
+                       help='Default spoken language code (e.g. en); skips language detection')
     parser.add_argument('--debug', action='store_true', help='Run in debug mode')
     
     args = parser.parse_args()
     
+    logging.basicConfig(
+        level=logging.DEBUG if args.debug else logging.INFO,
+        format="%(asctime)s %(levelname)s %(name)s: %(message)s"
+    )
+    
     # Load initial model
     print("=" * 60)
     print("🎤 CURSPER BACKEND STARTING UP")
     print("=" * 60)
     print(f"🌐 Starting Cursper backend on {args.host}:{args.port}")
-    print(f"🧠 Loading initial model: {args.model}")
+    print(f"🧠 Loading initial model: {args.model} (quantization: {args.quant})")
+    print(f"🗣️  Language: {args.language or 'auto-detect'}")
     print(f"🐛 Debug mode: {args.debug}")
     print(f"📋 Available models: {list(AVAILABLE_MODELS.keys())}")
     
-    success = load_model(args.model)
+    success = initialize_backend(args.model, args.quant, args.language)
     if not success:
         print("⚠️  Failed to load initial model, but continuing...")
     else:
-        print("✅ Initial model loaded successfully")
+        print("✅ Initial model loaded and inference pipeline warmed up")
     
     # Start Flask server
     print("=" * 60)
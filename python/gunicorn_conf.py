@@ -0,0 +1,43 @@
+"""
+Cursper - Gunicorn configuration
+Run the backend with: gunicorn -c gunicorn_conf.py app:app
+"""
+
+import logging
+import os
+import threading
+
+bind = f"{os.environ.get('CURSPER_HOST', '127.0.0.1')}:{os.environ.get('CURSPER_PORT', '8788')}"
+
+# One worker owns the model; its threads only handle HTTP I/O and wait on
+# the inference queue, so they never contend for the GPU
+workers = 1
+worker_class = "gthread"
+threads = 32
+timeout = 120
+keepalive = 5
+
+# Import the app (Flask, faster-whisper, CTranslate2) once in the master
+preload_app = True
+
+def post_worker_init(worker):
+    """Load the initial model inside the worker process.
+
+    CUDA contexts do not survive fork(), so the model is loaded after the
+    worker has been spawned rather than in the preloading master. Loading
+    runs in a background thread: a first-run download of a large model can
+    outlast `timeout`, and the worker must reach its run loop to heartbeat.
+    Until it finishes, /health reports model_loaded: false.
+    """
+    from app import initialize_backend
+
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s %(name)s: %(message)s")
+    model_size = os.environ.get("CURSPER_MODEL", "base")
+    quantization = os.environ.get("CURSPER_QUANT", "auto")
+    language = os.environ.get("CURSPER_LANGUAGE") or None
+
+    def load_initial_model():
+        if not initialize_backend(model_size, quantization, language):
+            worker.log.warning("Failed to load initial model %s, but continuing...", model_size)
+
+    threading.Thread(target=load_initial_model, name="cursper-initial-load", daemon=True).start()
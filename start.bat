@@ -3,7 +3,7 @@ echo 🎤 Starting Cursper...
 
 REM Check if Python dependencies are installed
 echo Checking Python dependencies...
-python -c "import flask, whisper" 2>nul
+python -c "import flask, faster_whisper" 2>nul
 if errorlevel 1 (
     echo Installing Python dependencies...
     cd python
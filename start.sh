@@ -5,7 +5,7 @@ echo "🎤 Starting Cursper..."
 
 # Check if Python dependencies are installed
 echo "Checking Python dependencies..."
-if ! python3 -c "import flask, whisper" 2>/dev/null; then
+if ! python3 -c "import flask, faster_whisper" 2>/dev/null; then
     echo "Installing Python dependencies..."
     cd python
     pip install -r requirements.txt